@@ -25,6 +25,9 @@ class Analysis:
         self.ud_path = ud_path
         self.ud_log = ud_log
         self.trace = Trace.load(trace_path)
+        if first_entry_index is not None and first_entry_index < 0:
+            # Count from the end of the trace.
+            first_entry_index = max(self.get_entry_count() + first_entry_index, 0)
         if (
             first_entry_index is not None
             or last_entry_index is not None
@@ -56,7 +59,21 @@ class Analysis:
         elif not os.path.exists(self.index_path.replace("{}", "header")):
             self.trace.build_insn_index(self.index_path)
         else:
-            self.trace.load_insn_index(self.index_path)
+            try:
+                self.trace.load_insn_index(self.index_path)
+            except Exception:
+                # The index was created for a different trace or by an
+                # incompatible version.
+                self.trace.build_insn_index(self.index_path)
+
+    def get_entry_count(self) -> int:
+        # With the index, seeking to the end does not require decoding the
+        # whole trace.
+        self.init_insn_index()
+        self.trace.seek_end()
+        entry_count = self.trace.get_entry_index()
+        self.trace.seek_start()
+        return entry_count
 
     @property
     def ud(self) -> Ud:
@@ -102,7 +119,7 @@ class Analysis:
                 yield trace_index
 
     def get_last_trace_for_pc(self, pc):
-        return max(self.get_traces_for_pc(pc))
+        return max(self.get_traces_for_pc(pc), default=None)
 
     def pp_code(self, code_index: int) -> str:
         pc = self.ud.get_pc_for_code(code_index)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 from collections import defaultdict
+import fcntl
+import functools
 import os
 import signal
+import stat
 import sys
 import threading
 
@@ -9,15 +12,10 @@ import click
 import click.types
 
 import memtrace
-from memtrace.analysis import Analysis
-from memtrace.format import format_entry
-from memtrace.interval_tree import IntervalTree
-from memtrace._memtrace import DumpKind, Tag
-from memtrace.notebook import open_notebook
-import memtrace.stats
-from memtrace.taint import BackwardAnalysis
-from memtrace.trace import Trace, TraceFilter
-import memtrace.tracer
+
+# Subcommands import what they need themselves: loading the native extension
+# and the analysis modules is relatively expensive, and e.g. "record" and
+# "--help" do not need any of that.
 
 
 @click.group(help="memtrace version " + memtrace.__version__)
@@ -27,47 +25,147 @@ def main():
 
 @main.command(help="Analyze the trace in a Jupyter notebook")
 def notebook():
+    from memtrace.notebook import open_notebook
+
     with open_notebook(click.echo):
         click.echo("Press Ctrl+C to stop the container.")
         threading.Event().wait()
 
 
+def get_mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 @main.command(
     context_settings={
+        "allow_interspersed_args": False,
         "ignore_unknown_options": True,
     },
     help="Run a command and record its execution trace",
 )
+@click.option(
+    "--compress",
+    help="Compress the trace using zstd",
+    is_flag=True,
+)
 @click.argument("argv", nargs=-1, type=click.UNPROCESSED)
-def record(argv):
+def record(compress, argv):
+    import memtrace.compression
+    import memtrace.tracer
+
+    prev_mtime = get_mtime_ns("memtrace.out")
     p = memtrace.tracer.popen(argv)
-    while True:
-        try:
-            status = p.wait()
-        except KeyboardInterrupt:
-            p.send_signal(signal.SIGINT)
-        else:
-            sys.exit(status)
+    # Let the tracee decide how to handle Ctrl+C.
+    prev_handler = signal.signal(
+        signal.SIGINT, lambda signum, frame: p.send_signal(signal.SIGINT)
+    )
+    try:
+        status = p.wait()
+    finally:
+        signal.signal(signal.SIGINT, prev_handler)
+    # Do not touch a trace that is left over from a previous run.
+    mtime = get_mtime_ns("memtrace.out")
+    if (
+        compress
+        and mtime is not None
+        and mtime != prev_mtime
+        and not memtrace.compression.is_zstd("memtrace.out")
+    ):
+        memtrace.compression.compress("memtrace.out")
+    sys.exit(status)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tag_choice():
+    from memtrace._memtrace import Tag
+
+    # Only tags in [MT_FIRST, MT_LAST) can be filtered on; header tags, such as
+    # MT_HEADER32, are below this range. MT_FIRST itself is an alias.
+    return click.Choice(
+        sorted(
+            name
+            for name, tag in Tag.names.items()
+            if Tag.MT_FIRST <= tag < Tag.MT_LAST and name != "MT_FIRST"
+        )
+    )
 
 
 class TagParamType(click.ParamType):
     name = "tag"
 
     def convert(self, value, param, ctx):
-        return Tag.names[value]
+        from memtrace._memtrace import Tag
+
+        # Reject unknown tags with a usage error listing the valid ones.
+        return Tag.names[get_tag_choice().convert(value, param, ctx)]
+
+    def shell_complete(self, ctx, param, incomplete):
+        return get_tag_choice().shell_complete(ctx, param, incomplete)
 
 
 class AnyIntParamType(click.types.IntParamType):
     def convert(self, value, param, ctx):
-        return int(value, 0)
+        if isinstance(value, int):
+            return value
+        try:
+            # Base 0 handles the 0x, 0o and 0b prefixes.
+            return int(value, 0)
+        except ValueError:
+            self.fail(f"{value!r} is not a valid integer", param, ctx)
 
 
 class AnyIntRangeParamType(click.ParamType):
     name = "range"
 
     def convert(self, value, param, ctx):
-        start, end = value.split("-")
-        return int(start, 0), int(end, 0)
+        if isinstance(value, tuple):
+            return value
+        start, sep, end = value.partition("-")
+        if sep == "":
+            self.fail(f"{value!r} is not a valid range", param, ctx)
+        return ANY_INT.convert(start, param, ctx), ANY_INT.convert(end, param, ctx)
+
+
+ANY_INT = AnyIntParamType()
+
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+# Not exposed by the fcntl module before Python 3.10.
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+
+def open_output(path):
+    return open(path, "w", buffering=OUTPUT_BUFFER_SIZE)
+
+
+def get_output_fd(path):
+    # Only consider descriptors that the process already holds: opening a
+    # named pipe just to resize it would hand its reader a premature EOF.
+    if path == "/dev/stdout":
+        return sys.stdout.fileno()
+    prefix = "/dev/fd/"
+    if path.startswith(prefix) and path[len(prefix) :].isdigit():
+        return int(path[len(prefix) :])
+    return None
+
+
+def grow_pipe(ctx, param, value):
+    # When the output goes to a pipe, e.g., "memtrace report | less", make the
+    # pipe buffer as large as the output buffer, so that each flush results in
+    # a single write() instead of blocking every 64k.
+    try:
+        fd = get_output_fd(value)
+        if fd is not None and stat.S_ISFIFO(os.fstat(fd).st_mode):
+            fcntl.fcntl(fd, F_SETPIPE_SZ, OUTPUT_BUFFER_SIZE)
+    except (OSError, ValueError):
+        # The descriptor is closed, or the size exceeds pipe-max-size.
+        pass
+    return value
 
 
 def input_option(function):
@@ -85,6 +183,7 @@ def output_option(function):
         "--output",
         default="/dev/stdout",
         help="Output file name",
+        callback=grow_pipe,
     )(function)
 
 
@@ -118,6 +217,24 @@ def default_index(input, index):
     return index
 
 
+def index_exists(index):
+    return os.path.exists(index.replace("{}", "header"))
+
+
+def drop_from_page_cache(path):
+    # Commands that scan the whole trace once should not leave it in the page
+    # cache at the expense of more useful data. Call this only after the trace
+    # is unmapped, since the kernel does not drop mapped pages. The path must be
+    # the one that was mapped, i.e., Trace.path.
+    if path is None or not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
 def ud_option(function):
     return click.option(
         "--ud",
@@ -128,9 +245,20 @@ def ud_option(function):
 
 @main.command(help="Print the trace as text")
 @input_option
+@index_option
 @output_option
 @start_option
 @end_option
+@click.option(
+    "--head",
+    help="Output only the first N entries; --tag and --insn-seq select among them",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--tail",
+    help="Output only the last N entries; --tag and --insn-seq select among them",
+    type=click.IntRange(min=1),
+)
 @click.option(
     "--tag",
     help="Output only entries with the specified tags",
@@ -148,20 +276,46 @@ def ud_option(function):
     help="Output only source file names and line numbers",
     is_flag=True,
 )
-def report(input, output, start, end, tag, insn_seq, srcline):
+def report(input, index, output, start, end, head, tail, tag, insn_seq, srcline):
+    from memtrace.analysis import Analysis
+    from memtrace._memtrace import Advice, DumpKind
+
+    if (head is not None) + (tail is not None) + (
+        start is not None or end is not None
+    ) > 1:
+        print(
+            "Specify at most one of --head, --tail and --start/--end", file=sys.stderr
+        )
+        sys.exit(1)
+    if head is not None:
+        end = head - 1
+    if tail is not None:
+        # Resolved by Analysis once the number of entries is known.
+        start = -tail
+    if index is None:
+        # Reuse the default index if it exists, but do not spend time on
+        # creating it.
+        index = default_index(input, index)
+        if not index_exists(index):
+            index = None
     if len(tag) == 0:
         tag = None
     if len(insn_seq) == 0:
         insn_seq = None
     with Analysis(
         input,
+        index_path=index,
         first_entry_index=start,
         last_entry_index=end,
         tags=tag,
         insn_seqs=insn_seq,
     ) as analysis:
-        if srcline:
+        analysis.trace.advise(Advice.Sequential)
+        if srcline or index is not None:
+            # The index allows skipping parts of the trace that contain no
+            # entries with the requested tags.
             analysis.init_insn_index()
+        if srcline:
             kind = DumpKind.Source
         else:
             kind = DumpKind.Raw
@@ -193,6 +347,8 @@ def report(input, output, start, end, tag, insn_seq, srcline):
     help="Write the analysis log into this file",
 )
 def ud(input, index, start, end, dot, html, csv, ud, log):
+    from memtrace.analysis import Analysis
+
     index = default_index(input, index)
     with Analysis(
         trace_path=input,
@@ -202,20 +358,27 @@ def ud(input, index, start, end, dot, html, csv, ud, log):
         first_entry_index=start,
         last_entry_index=end,
     ) as analysis:
-        if dot is not None:
-            analysis.ud.dump_dot(dot)
-        if html is not None:
-            analysis.ud.dump_html(html)
-        if csv is not None:
-            analysis.ud.dump_csv(csv)
+        if dot is not None or html is not None or csv is not None:
+            # Produce all the requested formats in one go, so that the
+            # analysis results are traversed only once.
+            analysis.ud.dump(dot=dot, html=html, csv=csv)
 
 
 @main.command(help="Analyze distribution of tags in the trace")
 @input_option
+@index_option
 @output_option
-def stats(input, output):
-    stats = memtrace.stats.from_trace_file(input)
-    with open(output, "w") as fp:
+def stats(input, index, output):
+    import memtrace.stats
+    from memtrace.trace import Trace
+
+    index = default_index(input, index)
+    trace = Trace.load(input)
+    stats = memtrace.stats.from_trace(trace, index)
+    path = trace.path
+    del trace
+    drop_from_page_cache(path)
+    with open_output(output) as fp:
         memtrace.stats.pp(stats, fp)
 
 
@@ -223,14 +386,30 @@ def stats(input, output):
 @input_option
 @index_option
 def index(input, index):
+    from memtrace.trace import Trace
+    from memtrace._memtrace import Advice
+
     index = default_index(input, index)
-    Trace.load(input).build_insn_index(index)
+    trace = Trace.load(input)
+    trace.advise(Advice.Sequential)
+    trace.build_insn_index(index)
+    path = trace.path
+    del trace
+    drop_from_page_cache(path)
 
 
 def resolve_pc(analysis, pc):
-    analysis.ud
-    analysis.trace.seek_end()
     resolved_pc = analysis.symbolizer.resolve(pc)
+    if resolved_pc is None:
+        # Symbols are looked up in the ELF files that are mapped by the end of
+        # the trace. Finding them requires only the instruction index, and not
+        # the use-def analysis.
+        analysis.init_insn_index()
+        analysis.trace.seek_end()
+        resolved_pc = analysis.symbolizer.resolve(pc)
+        # The use-def analysis, which may run next, starts at the current
+        # position.
+        analysis.trace.seek_start()
     if resolved_pc is None:
         print(f"Cannot find symbol '{pc}'", file=sys.stderr)
         sys.exit(1)
@@ -247,6 +426,8 @@ def resolve_pc(analysis, pc):
 @output_option
 @click.argument("pc")
 def traces_for_pc(input, index, ud, output, pc):
+    from memtrace.analysis import Analysis
+
     index = default_index(input, index)
     with Analysis(
         trace_path=input,
@@ -254,9 +435,12 @@ def traces_for_pc(input, index, ud, output, pc):
         ud_path=ud,
     ) as analysis:
         resolved_pc = resolve_pc(analysis, pc)
-        with open(output, "w") as fp:
-            for trace in analysis.get_traces_for_pc(resolved_pc):
-                fp.write(f"{trace}\n")
+        with open_output(output) as fp:
+            fp.write(
+                "".join(
+                    f"{trace}\n" for trace in analysis.get_traces_for_pc(resolved_pc)
+                )
+            )
 
 
 @main.command(help="Perform backward taint analysis on the trace")
@@ -278,6 +462,10 @@ def traces_for_pc(input, index, ud, output, pc):
     help="Do not follow these registers",
 )
 def taint_backward(input, index, ud, output, pc, trace, depth, ignore_register):
+    from memtrace.analysis import Analysis
+    from memtrace.taint import BackwardAnalysis
+    from memtrace._memtrace import Advice
+
     if (trace is None) == (pc is None):
         print("Specify either --pc or --trace", file=sys.stderr)
         sys.exit(1)
@@ -290,14 +478,20 @@ def taint_backward(input, index, ud, output, pc, trace, depth, ignore_register):
         if trace is None:
             resolved_pc = resolve_pc(analysis, pc)
             trace = analysis.get_last_trace_for_pc(resolved_pc)
+            if trace is None:
+                print(f"'{pc}' was never executed", file=sys.stderr)
+                sys.exit(1)
         backward = BackwardAnalysis(
             analysis,
             trace_index0=trace,
             depth=depth,
             ignore_registers=ignore_register,
         )
+        # Use-def analysis is done, from now on the trace is accessed only
+        # by seeking to individual instructions.
+        analysis.trace.advise(Advice.Random)
         dag = backward.analyze()
-        with open(output, "w") as fp:
+        with open_output(output) as fp:
             dag.pp(analysis, fp)
 
 
@@ -319,6 +513,10 @@ def taint_backward(input, index, ud, output, pc, trace, depth, ignore_register):
     help="Number of trace entries to pretty-print",
 )
 def dump_entries(input, index, ud, output, start_trace, count):
+    from memtrace.analysis import Analysis
+    from memtrace.format import format_entry
+    from memtrace._memtrace import Tag
+
     index = default_index(input, index)
     with Analysis(
         trace_path=input,
@@ -327,7 +525,7 @@ def dump_entries(input, index, ud, output, start_trace, count):
     ) as analysis:
         analysis.ud
         analysis.trace.seek_insn(start_trace)
-        with open(output, "w") as fp:
+        with open_output(output) as fp:
             for _ in range(count):
                 entry = next(analysis.trace)
                 entry_str = format_entry(
@@ -350,6 +548,12 @@ def dump_entries(input, index, ud, output, start_trace, count):
 @output_option
 @click.argument("pc-range", nargs=-1)
 def ldst(input, index, ud, output, pc_range):
+    from memtrace.analysis import Analysis
+    from memtrace.format import format_entry
+    from memtrace.interval_tree import IntervalTree
+    from memtrace.trace import TraceFilter
+    from memtrace._memtrace import Tag
+
     index = default_index(input, index)
     with Analysis(
         trace_path=input,
@@ -381,7 +585,7 @@ def ldst(input, index, ud, output, pc_range):
             entries = mem[start:end]
             entries[entry.insn_seq][entry.index] = entry
             mem[start:end] = entries
-        with open(output, "w") as fp:
+        with open_output(output) as fp:
             for node in mem:
                 fp.write(f"* 0x{node.start:x}-0x{node.end:x}\n")
                 for insn_seq, index2entry in node.value.items():
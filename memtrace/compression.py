@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+from typing import Optional
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CHUNK_SIZE = 1024 * 1024
+
+
+def import_zstandard(path):
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception(f"Reading or writing {path} requires zstandard")
+    return zstandard
+
+
+def is_zstd(path: str) -> bool:
+    with open(path, "rb") as fp:
+        return fp.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC
+
+
+def decompress(src: str, dst: str) -> None:
+    zstandard = import_zstandard(src)
+    with open(src, "rb") as ifp, open(dst, "wb") as ofp:
+        zstandard.ZstdDecompressor().copy_stream(
+            ifp, ofp, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE
+        )
+
+
+# The native code needs a mappable file, so keep a decompressed copy next to
+# the compressed trace: temporary directories are often too small for it. The
+# copy carries the mtime of the compressed trace, which allows the subsequent
+# commands to reuse it until the compressed trace changes. Returns None if the
+# directory of the compressed trace is not writable.
+def get_decompressed(path: str) -> Optional[str]:
+    decompressed_path = path + ".decompressed"
+    st = os.stat(path)
+    try:
+        if os.stat(decompressed_path).st_mtime_ns == st.st_mtime_ns:
+            return decompressed_path
+    except FileNotFoundError:
+        pass
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    except OSError:
+        return None
+    try:
+        os.close(fd)
+        decompress(path, tmp_path)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, decompressed_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    print(
+        f"Decompressed {path} into {decompressed_path}, which is kept for the "
+        "subsequent commands; delete it to reclaim the space",
+        file=sys.stderr,
+    )
+    return decompressed_path
+
+
+def compress(path: str, level: int = 3) -> None:
+    zstandard = import_zstandard(path)
+    compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with open(path, "rb") as ifp, os.fdopen(fd, "wb") as ofp:
+            compressor.copy_stream(
+                ifp,
+                ofp,
+                size=os.fstat(ifp.fileno()).st_size,
+                read_size=CHUNK_SIZE,
+                write_size=CHUNK_SIZE,
+            )
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
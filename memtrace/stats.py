@@ -1,17 +1,36 @@
 #!/usr/bin/env python3
+import os
+from typing import Optional
+
 from memtrace.trace import Trace
+from ._memtrace import Advice
+
+
+def from_trace_file(path, index_path: Optional[str] = None):
+    return from_trace(Trace.load(path), index_path)
 
 
-def from_trace_file(path):
-    return Trace.load(path).gather_stats()
+def from_trace(trace: Trace, index_path: Optional[str] = None):
+    trace.advise(Advice.Sequential)
+    if index_path is None or not os.path.exists(index_path.replace("{}", "header")):
+        return trace.gather_stats()
+    # The instruction index tells where entries start, which allows splitting
+    # the trace into chunks that can be processed in parallel.
+    try:
+        trace.load_insn_index(index_path)
+    except Exception:
+        return trace.gather_stats()
+    return trace.gather_stats_parallel(os.cpu_count() or 1)
 
 
 def pp(stats, fp):
     tag_stats = {entry.key(): entry.data() for entry in stats.tag_stats}
     total_count = 0
     total_size = 0
+    lines = []
     for tag, tag_stats in sorted(tag_stats.items(), key=str):
-        fp.write(f"{tag} count={tag_stats.count} size={tag_stats.size}\n")
+        lines.append(f"{tag} count={tag_stats.count} size={tag_stats.size}\n")
         total_count += tag_stats.count
         total_size += tag_stats.size
-    fp.write(f"total count={total_count} size={total_size}\n")
+    lines.append(f"total count={total_count} size={total_size}\n")
+    fp.writelines(lines)
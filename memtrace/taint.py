@@ -9,6 +9,9 @@ from memtrace.trace import Trace
 from memtrace.ud import Ud
 from ._memtrace import Entry, Tag
 
+# Number of lines BackwardNode.pp() accumulates before writing them out.
+PP_BATCH_SIZE = 256
+
 
 @dataclass
 class BackwardNode:
@@ -35,7 +38,7 @@ class BackwardNode:
                 self.is_fresh = True
                 self.edges = iter(edge.dst.edges.values())
 
-        fp.write("#+STARTUP: indent\n")
+        lines: List[str] = ["#+STARTUP: indent\n"]
         stack: List[StackEntry] = [StackEntry(BackwardEdge(self))]
         seen: Set[int] = set()
         while len(stack) > 0:
@@ -51,7 +54,7 @@ class BackwardNode:
                     prefix, suffix = "[[", "]]"
                 else:
                     prefix, suffix = "<<", ">>"
-                fp.write(
+                lines.append(
                     f"{indent} {prefix}InsnInTrace:{node.trace_index}"
                     f"{suffix} {disasm_str}\n"
                 )
@@ -62,7 +65,7 @@ class BackwardNode:
                         disasm=analysis.disasm,
                         trace=analysis.trace,
                     )
-                    fp.write(f"Reason: {entry_str}\n")
+                    lines.append(f"Reason: {entry_str}\n")
                 for trace_entry in edge.mem:
                     entry_str = format_entry(
                         entry=trace_entry,
@@ -70,7 +73,10 @@ class BackwardNode:
                         disasm=analysis.disasm,
                         trace=analysis.trace,
                     )
-                    fp.write(f"Reason: {entry_str}\n")
+                    lines.append(f"Reason: {entry_str}\n")
+                if len(lines) >= PP_BATCH_SIZE:
+                    fp.writelines(lines)
+                    lines.clear()
                 if is_seen:
                     stack.pop()
                     continue
@@ -82,6 +88,7 @@ class BackwardNode:
                 stack.pop()
                 continue
             stack.append(StackEntry(edge))
+        fp.writelines(lines)
 
 
 @dataclass
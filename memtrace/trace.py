@@ -1,7 +1,17 @@
+import os
+import tempfile
 from typing import Any, Iterable, Optional
 
+from memtrace.compression import decompress, get_decompressed, is_zstd
 from memtrace.native import wrap_err
-from memtrace._memtrace import DumpKind, Tag, _Trace, _TraceFilter, VectorOfU32s
+from memtrace._memtrace import (
+    Advice,
+    DumpKind,
+    Tag,
+    _Trace,
+    _TraceFilter,
+    VectorOfU32s,
+)
 
 
 class TraceFilter:
@@ -41,13 +51,27 @@ class TraceFilter:
 class Trace:
     @staticmethod
     def load(path: str) -> "Trace":
+        if is_zstd(path):
+            decompressed_path = get_decompressed(path)
+            if decompressed_path is None:
+                # The mapping outlives the temporary copy.
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    tmp_path = os.path.join(tmpdir, "memtrace.out")
+                    decompress(path, tmp_path)
+                    trace = Trace.load(tmp_path)
+                trace.path = None
+                return trace
+            path = decompressed_path
         native = _Trace.load(path)
         if native is None:
             raise Exception("_Trace.load() failed")
-        return Trace(native)
+        return Trace(native, path)
 
-    def __init__(self, native: _Trace):
+    def __init__(self, native: _Trace, path: Optional[str] = None):
         self.native = native
+        # The mapped file, which differs from the one passed to load() for
+        # compressed traces. None if it no longer exists.
+        self.path = path
 
     def __getattr__(self, name: str) -> Any:
         return getattr(self.native, name)
@@ -74,6 +98,10 @@ class Trace:
     def seek_end(self) -> None:
         pass
 
+    @wrap_err
+    def advise(self, advice: Advice) -> None:
+        pass
+
     @wrap_err
     def dump(self, output: Optional[str], kind: DumpKind) -> None:
         pass
@@ -50,6 +50,15 @@ class Ud:
     def dump_csv(self, path):
         pass
 
+    @wrap_err
+    def dump(
+        self,
+        dot: Optional[str] = None,
+        html: Optional[str] = None,
+        csv: Optional[str] = None,
+    ):
+        pass
+
     def get_codes_for_pc_ranges(self, pc_ranges: List[Tuple[int, int]]) -> List[int]:
         native_pc_ranges = VectorOfRanges()
         native_pc_ranges.extend(
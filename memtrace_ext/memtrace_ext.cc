@@ -19,7 +19,6 @@
 #include <iterator>
 #include <map>
 #include <memory>
-#include <set>
 #include <string>
 #include <string_view>
 #include <type_traits>
@@ -170,6 +169,29 @@ int WriteHeader(const char* path, const Header& header) {
   return n_written == 1 ? 0 : -EIO;
 }
 
+// Dumps consist of many short lines, use a large buffer in order to issue
+// few write() calls.
+constexpr size_t kOutputBufferSize = 1024 * 1024;
+
+std::FILE* OpenOutput(const char* path) {
+  std::FILE* f = std::fopen(path, "w");
+  if (f == nullptr) return nullptr;
+  std::setvbuf(f, nullptr, _IOFBF, kOutputBufferSize);
+  return f;
+}
+
+struct FileCloser {
+  void operator()(std::FILE* f) { std::fclose(f); }
+};
+
+using FilePtr = std::unique_ptr<std::FILE, FileCloser>;
+
+// Because of buffering, write errors may be detected only by std::fclose().
+int CloseOutput(FilePtr* f) {
+  if (*f && std::fclose(f->release()) == EOF) return -errno;
+  return 0;
+}
+
 template <Endianness E, typename W>
 class Trace;
 
@@ -373,6 +395,11 @@ struct Stats {
   std::map<Tag, TagStats> tagStats;
 };
 
+constexpr size_t kTagCount =
+    static_cast<size_t>(Tag::MT_LAST) - static_cast<size_t>(Tag::MT_FIRST);
+
+using ChunkStats = std::array<TagStats, kTagCount>;
+
 struct EntryPy {
   explicit EntryPy(size_t index) : index(index) {}
   EntryPy(const EntryPy&) = delete;
@@ -523,6 +550,11 @@ struct MmapIndexEntry {
   size_t fileOffset;
 };
 
+std::uint32_t GetTagBit(Tag tag) {
+  return 1 << (static_cast<std::uint16_t>(tag) -
+               static_cast<std::uint16_t>(Tag::MT_FIRST));
+}
+
 struct TraceFilter {
   TraceFilter()
       : firstEntryIndex(std::numeric_limits<size_t>::min()),
@@ -533,34 +565,61 @@ struct TraceFilter {
     return entryIndex >= firstEntryIndex && entryIndex <= lastEntryIndex;
   }
 
-  bool isTagOk(Tag tag) const {
-    return tagMask & (1 << (static_cast<std::uint16_t>(tag) -
-                            static_cast<std::uint16_t>(Tag::MT_FIRST)));
+  // Whether any of the entries in [start, end) is ok.
+  bool isEntryIndexRangeOk(size_t start, size_t end) const {
+    return start <= lastEntryIndex && end > firstEntryIndex;
   }
 
-  std::vector<std::uint32_t> GetInsnSeqs() const {
-    return std::vector<std::uint32_t>(insnSeqs.begin(), insnSeqs.end());
+  bool isTagOk(Tag tag) const { return tagMask & GetTagBit(tag); }
+
+  bool isTagMaskOk(std::uint32_t spanTagMask) const {
+    return tagMask & spanTagMask;
   }
 
+  std::vector<std::uint32_t> GetInsnSeqs() const { return insnSeqs; }
+
   void SetInsnSeqs(const std::vector<std::uint32_t>& insnSeqs) {
-    this->insnSeqs = std::set<std::uint32_t>(insnSeqs.begin(), insnSeqs.end());
+    this->insnSeqs = insnSeqs;
+    std::sort(this->insnSeqs.begin(), this->insnSeqs.end());
+    this->insnSeqs.erase(
+        std::unique(this->insnSeqs.begin(), this->insnSeqs.end()),
+        this->insnSeqs.end());
+    insnSeqMask.assign(
+        this->insnSeqs.empty()
+            ? 0
+            : std::min(static_cast<size_t>(this->insnSeqs.back()) + 1,
+                       kMaxInsnSeqMaskSize),
+        false);
+    for (std::uint32_t insnSeq : this->insnSeqs)
+      if (insnSeq < insnSeqMask.size()) insnSeqMask[insnSeq] = true;
   }
 
   bool isMissingInsnSeqOk() const { return insnSeqs.empty(); }
 
   bool isInsnSeqOk(std::uint32_t insnSeq) const {
-    return insnSeqs.empty() || insnSeqs.find(insnSeq) != insnSeqs.end();
+    if (insnSeqs.empty()) return true;
+    if (insnSeq < insnSeqMask.size()) return insnSeqMask[insnSeq];
+    return std::binary_search(insnSeqs.begin(), insnSeqs.end(), insnSeq);
   }
 
   size_t firstEntryIndex;
   size_t lastEntryIndex;
   std::uint32_t tagMask;
-  std::set<std::uint32_t> insnSeqs;
+  std::vector<std::uint32_t> insnSeqs;  // Sorted.
+  // Checking a bit is much cheaper than a set lookup for every entry. The
+  // mask covers only small insn seqs, since large ones may come from user
+  // input; those are looked up in insnSeqs.
+  static constexpr size_t kMaxInsnSeqMaskSize = 1 << 20;
+  std::vector<bool> insnSeqMask;
 };
 
 struct TraceFilterNoOp {
   bool isEntryIndexOk(size_t /* entryIndex */) const { return true; }
+  bool isEntryIndexRangeOk(size_t /* start */, size_t /* end */) const {
+    return true;
+  }
   bool isTagOk(Tag /* tag */) const { return true; }
+  bool isTagMaskOk(std::uint32_t /* spanTagMask */) const { return true; }
   bool isMissingInsnSeqOk() const { return true; }
   bool isInsnSeqOk(std::uint32_t /* insnSeq */) const { return true; }
 };
@@ -581,6 +640,25 @@ const char* GetStr(DumpKind kind) {
   }
 }
 
+enum class Advice {
+  Normal,
+  Sequential,
+  Random,
+};
+
+const char* GetStr(Advice advice) {
+  switch (advice) {
+    case Advice::Normal:
+      return "Normal";
+    case Advice::Sequential:
+      return "Sequential";
+    case Advice::Random:
+      return "Random";
+    default:
+      return nullptr;
+  }
+}
+
 class TraceBase {
  public:
   static TraceBase* Load(const char* path);
@@ -598,7 +676,10 @@ class TraceBase {
   virtual int SeekStart() = 0;
   virtual int SeekInsn(std::uint32_t index) = 0;
   virtual int SeekEnd() = 0;
+  virtual size_t GetEntryIndex() = 0;
+  virtual int Advise(Advice advice) = 0;
   virtual Stats GatherStats() = 0;
+  virtual Stats GatherStatsParallel(int nThreads) = 0;
   virtual bool HasInsnIndex() = 0;
   virtual int BuildInsnIndex(const char* path, size_t stepShift) = 0;
   virtual int LoadInsnIndex(const char* path) = 0;
@@ -672,9 +753,38 @@ struct MemDefSeeker : public DefSeeker<W> {
   using DefSeeker<W>::operator();
 };
 
+// Bump whenever the layout of the index files changes.
+constexpr std::uint8_t kInsnIndexVersion = 2;
+
 struct InsnIndexHeader {
   TraceId traceId;
   std::uint8_t stepShift;
+  std::uint8_t version;
+  std::uint8_t hostEndianness;
+  std::uint8_t hostWordSize;
+  // Record strides of the data, mmap and tags files.
+  std::uint8_t insnIndexEntrySize;
+  std::uint8_t mmapIndexEntrySize;
+  std::uint8_t tagMaskEntrySize;
+
+  void InitHost() {
+    version = kInsnIndexVersion;
+    hostEndianness = static_cast<std::uint8_t>(kHostEndianness);
+    hostWordSize = static_cast<std::uint8_t>(kHostWordSize);
+    insnIndexEntrySize = static_cast<std::uint8_t>(sizeof(InsnIndexEntry));
+    mmapIndexEntrySize = static_cast<std::uint8_t>(sizeof(MmapIndexEntry));
+    tagMaskEntrySize = static_cast<std::uint8_t>(sizeof(std::uint32_t));
+  }
+
+  bool IsHostCompatible() const {
+    InsnIndexHeader host;
+    host.InitHost();
+    return version == host.version && hostEndianness == host.hostEndianness &&
+           hostWordSize == host.hostWordSize &&
+           insnIndexEntrySize == host.insnIndexEntrySize &&
+           mmapIndexEntrySize == host.mmapIndexEntrySize &&
+           tagMaskEntrySize == host.tagMaskEntrySize;
+  }
 };
 
 using RegMeta = std::map<std::pair<std::uint16_t, std::uint16_t>, const char*>;
@@ -741,8 +851,27 @@ class Trace : public TraceBase {
   int VisitAll(V* visitor, const F& filter) {
     int err;
     if ((err = InitVisitor(visitor)) < 0) return err;
-    while (cur_ != end_)
+    // Use the instruction index in order to skip spans that contain no
+    // entries the filter is interested in. The last span runs until the end
+    // of the trace and is never skipped.
+    size_t spanCount = HasInsnIndex() ? tagMaskIndex_.size() : 0;
+    size_t span = FindSpan(static_cast<size_t>(cur_ - data_));
+    while (cur_ != end_) {
+      // Stop as soon as no more entries can pass the filter.
+      if (!filter.isEntryIndexRangeOk(entryIndex_,
+                                      std::numeric_limits<size_t>::max()))
+        break;
+      if (span < spanCount && cur_ == data_ + insnIndex_[span].fileOffset) {
+        if (span + 1 < spanCount &&
+            (!filter.isTagMaskOk(tagMaskIndex_[span]) ||
+             !filter.isEntryIndexRangeOk(insnIndex_[span].entryIndex,
+                                         insnIndex_[span + 1].entryIndex)))
+          Rewind(insnIndex_[span + 1]);
+        span++;
+        continue;
+      }
       if ((err = VisitOne(visitor, filter)) < 0) return err;
+    }
     if ((err = visitor->Complete()) < 0) return err;
     return 0;
   }
@@ -892,6 +1021,27 @@ class Trace : public TraceBase {
     return 0;
   }
 
+  size_t GetEntryIndex() override { return entryIndex_; }
+
+  int Advise(Advice advice) override {
+    int madvice;
+    switch (advice) {
+      case Advice::Normal:
+        madvice = MADV_NORMAL;
+        break;
+      case Advice::Sequential:
+        madvice = MADV_SEQUENTIAL;
+        break;
+      case Advice::Random:
+        madvice = MADV_RANDOM;
+        break;
+      default:
+        return -EINVAL;
+    }
+    if (madvise(data_, length_, madvice) < 0) return -errno;
+    return 0;
+  }
+
   template <typename DefSeeker>
   [[nodiscard]] int SeekDef(std::uint32_t insnIndex, std::uint32_t defIndex,
                             Range<W>* range) {
@@ -922,6 +1072,46 @@ class Trace : public TraceBase {
     return visitor.stats;
   }
 
+  Stats GatherStatsParallel(int nThreads) override {
+#ifndef _OPENMP
+    nThreads = 1;
+#endif
+    // Parsing can start only at entry boundaries, which are known only
+    // from the instruction index.
+    if (!HasInsnIndex() || filter_ != nullptr || insnIndex_.size() == 0 ||
+        nThreads <= 1)
+      return GatherStats();
+    size_t nChunks = static_cast<size_t>(nThreads);
+    std::vector<size_t> bounds;
+    bounds.push_back(header_.GetTlv().GetAlignedLength());
+    for (size_t chunk = 1; chunk < nChunks; chunk++)
+      bounds.push_back(
+          std::max(bounds.back(),
+                   insnIndex_[chunk * insnIndex_.size() / nChunks].fileOffset));
+    bounds.push_back(length_);
+    std::vector<ChunkStats> chunkStats(nChunks);
+    int err = 0;
+#ifdef _OPENMP
+#pragma omp parallel for num_threads(nThreads) reduction(min : err)
+#endif
+    for (size_t chunk = 0; chunk < nChunks; chunk++)
+      err = std::min(err, GatherChunkStats(bounds[chunk], bounds[chunk + 1],
+                                           &chunkStats[chunk]));
+    if (err < 0) throw std::runtime_error("Failed to parse the next entry");
+    StatsGatherer visitor;
+    if (InitVisitor(&visitor) < 0)
+      throw std::runtime_error("Failed to parse the header");
+    for (const ChunkStats& stats : chunkStats)
+      for (size_t i = 0; i < kTagCount; i++) {
+        if (stats[i].count == 0) continue;
+        TagStats& tagStats = visitor.stats.tagStats[static_cast<Tag>(
+            static_cast<size_t>(Tag::MT_FIRST) + i)];
+        tagStats.count += stats[i].count;
+        tagStats.size += stats[i].size;
+      }
+    return visitor.stats;
+  }
+
   bool HasInsnIndex() override {
     return insnIndexStepShift_ != static_cast<size_t>(-1);
   }
@@ -937,26 +1127,38 @@ class Trace : public TraceBase {
     if ((err = mmapIndex_.Init(indexPath.Get("mmap").c_str(),
                                InitMode::CreatePersistent)) < 0)
       return err;
+    if ((err = tagMaskIndex_.Init(indexPath.Get("tags").c_str(),
+                                  InitMode::CreatePersistent)) < 0)
+      return err;
     size_t stepMask = (1 << stepShift) - 1;
     ScopedRewind scopedRewind(this);
     Rewind();
     Indexer visitor;
     size_t prevInsnIndex = visitor.seeker.insnIndex;
+    // Tags that occur between the last and the next insnIndex_ entries.
+    std::uint32_t spanTagMask = 0;
     while (cur_ != end_) {
       std::uint8_t* prev = cur_;
-      if ((err = VisitOne(&visitor)) < 0) return err;
+      // The index must cover all entries regardless of the filter.
+      if ((err = VisitOne(&visitor, TraceFilterNoOp())) < 0) return err;
       if (visitor.seeker.insnIndex != prevInsnIndex) {
-        if ((visitor.seeker.insnIndex & stepMask) == 0)
+        if ((visitor.seeker.insnIndex & stepMask) == 0) {
+          if (insnIndex_.size() != 0) tagMaskIndex_.push_back(spanTagMask);
+          spanTagMask = 0;
           insnIndex_.push_back(InsnIndexEntry{static_cast<size_t>(prev - data_),
                                               entryIndex_ - 1});
+        }
         prevInsnIndex = visitor.seeker.insnIndex;
       }
+      spanTagMask |= GetTagBit(Tlv<E, W>(prev).GetTag());
       if (visitor.isMmap)
         mmapIndex_.push_back(MmapIndexEntry{static_cast<size_t>(prev - data_)});
     }
+    if (insnIndex_.size() != 0) tagMaskIndex_.push_back(spanTagMask);
     InsnIndexHeader header;
     header.traceId = header_.GetTraceId();
     header.stepShift = static_cast<std::uint8_t>(stepShift);
+    header.InitHost();
     if ((err = WriteHeader(indexPath.Get("header").c_str(), header)) < 0)
       return err;
     insnIndexStepShift_ = stepShift;
@@ -971,13 +1173,18 @@ class Trace : public TraceBase {
     InsnIndexHeader header;
     if ((err = ReadHeader(indexPath.Get("header").c_str(), &header)) < 0)
       return err;
-    if (header.traceId != header_.GetTraceId()) return -EINVAL;
+    if (header.traceId != header_.GetTraceId() || !header.IsHostCompatible())
+      return -EINVAL;
     if ((err = insnIndex_.Init(indexPath.Get("data").c_str(),
                                InitMode::OpenExisting)) < 0)
       return err;
     if ((err = mmapIndex_.Init(indexPath.Get("mmap").c_str(),
                                InitMode::OpenExisting)) < 0)
       return err;
+    if ((err = tagMaskIndex_.Init(indexPath.Get("tags").c_str(),
+                                  InitMode::OpenExisting)) < 0)
+      return err;
+    if (tagMaskIndex_.size() != insnIndex_.size()) return -EINVAL;
     insnIndexStepShift_ = header.stepShift;
     return 0;
   }
@@ -997,7 +1204,7 @@ class Trace : public TraceBase {
   };
 
   int Dump(const char* path, DumpKind kind) override {
-    FILE* f = fopen(path, "w");
+    FILE* f = OpenOutput(path);
     if (f == nullptr) return -errno;
     int err;
     switch (kind) {
@@ -1047,6 +1254,25 @@ class Trace : public TraceBase {
  private:
   bool Have(size_t n) const { return cur_ + n <= end_; }
 
+  // Does not touch the cursor, so that chunks can be processed concurrently.
+  int GatherChunkStats(size_t startOffset, size_t endOffset,
+                       ChunkStats* stats) const {
+    const std::uint8_t* cur = data_ + startOffset;
+    const std::uint8_t* end = data_ + endOffset;
+    while (cur != end) {
+      if (cur + Tlv<E, W>::kFixedLength > end) return -EINVAL;
+      Tlv<E, W> tlv(cur);
+      size_t alignedLength = tlv.GetAlignedLength();
+      if (alignedLength == 0 || cur + alignedLength > end) return -EINVAL;
+      size_t i = static_cast<size_t>(tlv.GetTag()) -
+                 static_cast<size_t>(Tag::MT_FIRST);
+      if (i >= kTagCount) return -EINVAL;
+      (*stats)[i].AddTlv(tlv);
+      cur += alignedLength;
+    }
+    return 0;
+  }
+
   bool Advance(size_t n) {
     std::uint8_t* next = cur_ + n;
     if (next > end_) return false;
@@ -1064,6 +1290,17 @@ class Trace : public TraceBase {
     entryIndex_ = entry.entryIndex;
   }
 
+  // Returns the index of the first insnIndex_ entry at or after fileOffset.
+  size_t FindSpan(size_t fileOffset) {
+    if (!HasInsnIndex()) return 0;
+    return static_cast<size_t>(
+        std::lower_bound(insnIndex_.begin(), insnIndex_.end(), fileOffset,
+                         [](const InsnIndexEntry& entry, size_t fileOffset) {
+                           return entry.fileOffset < fileOffset;
+                         }) -
+        insnIndex_.begin());
+  }
+
   size_t FindMmapFileOffset(size_t fileOffset) const {
     MmVector<MmapIndexEntry>::const_iterator it =
         std::upper_bound(mmapIndex_.begin(), mmapIndex_.end(), fileOffset,
@@ -1135,6 +1372,8 @@ class Trace : public TraceBase {
   HeaderEntry<E, W> header_;
   MmVector<InsnIndexEntry> insnIndex_;
   MmVector<MmapIndexEntry> mmapIndex_;
+  // Per insnIndex_ entry: tags that occur until the next entry.
+  MmVector<std::uint32_t> tagMaskIndex_;
   size_t insnIndexStepShift_;
   std::shared_ptr<TraceFilter> filter_;
   RegMeta regMeta_;
@@ -1158,6 +1397,10 @@ int MmapFile(const char* path, size_t minSize, std::uint8_t** p,
     close(fd);
     return -EINVAL;
   }
+  // Traces are mostly consumed front to back, so ask for a larger readahead
+  // window. The hint sticks to the open file description, which the mapping
+  // keeps alive after the fd is closed.
+  posix_fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL);
   void* data = mmap(nullptr, stat.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
   int err = errno;
   close(fd);
@@ -1495,46 +1738,17 @@ class UdState {
   }
 
   template <Endianness E, std::uint32_t InsnInTrace::*StartDefIndex>
-  [[nodiscard]] int DumpUsesDot(std::FILE* f, std::uint32_t traceIndex,
+  [[nodiscard]] int ResolveUses(std::vector<ResolvedUse<W>>* uses,
                                 std::uint32_t startIndex,
                                 std::uint32_t endIndex,
                                 const MmVector<InsnInTrace>& trace,
-                                Trace<E, W>* fullTrace,
-                                const char* prefix) const {
-    for (std::uint32_t useIndex = startIndex; useIndex < endIndex; useIndex++) {
-      ResolvedUse<W> use;
-      int err;
-      if ((err = ResolveUse<E, StartDefIndex>(&use, useIndex, trace,
-                                              fullTrace)) < 0)
-        return err;
-      std::fprintf(f,
-                   "    %" PRIu32 " -> %" PRIu32 " [label=\"%s0x%" PRIx64
-                   "-0x%" PRIx64 "\"]\n",
-                   traceIndex, use.traceIndex, prefix,
-                   static_cast<std::uint64_t>(use.range.startAddr),
-                   static_cast<std::uint64_t>(use.range.endAddr));
-    }
-    return 0;
-  }
-
-  template <Endianness E, std::uint32_t InsnInTrace::*StartDefIndex>
-  [[nodiscard]] int DumpUsesHtml(std::FILE* f, std::uint32_t startIndex,
-                                 std::uint32_t endIndex,
-                                 const MmVector<InsnInTrace>& trace,
-                                 Trace<E, W>* fullTrace,
-                                 const char* prefix) const {
+                                Trace<E, W>* fullTrace) const {
+    uses->resize(endIndex - startIndex);
     for (std::uint32_t useIndex = startIndex; useIndex < endIndex; useIndex++) {
-      ResolvedUse<W> use;
       int err;
-      if ((err = ResolveUse<E, StartDefIndex>(&use, useIndex, trace,
-                                              fullTrace)) < 0)
+      if ((err = ResolveUse<E, StartDefIndex>(&(*uses)[useIndex - startIndex],
+                                              useIndex, trace, fullTrace)) < 0)
         return err;
-      std::fprintf(f,
-                   "            <a href=\"#%" PRIu32 "\">%s0x%" PRIx64
-                   "-0x%" PRIx64 "</a>\n",
-                   use.traceIndex, prefix,
-                   static_cast<std::uint64_t>(use.range.startAddr),
-                   static_cast<std::uint64_t>(use.range.endAddr));
     }
     return 0;
   }
@@ -1558,27 +1772,6 @@ class UdState {
     return 0;
   }
 
-  template <Endianness E, std::uint32_t InsnInTrace::*StartDefIndex>
-  [[nodiscard]] int DumpUsesCsv(std::FILE* f, std::uint32_t traceIndex,
-                                std::uint32_t startIndex,
-                                std::uint32_t endIndex,
-                                const MmVector<InsnInTrace>& trace,
-                                Trace<E, W>* fullTrace,
-                                const char* prefix) const {
-    for (std::uint32_t useIndex = startIndex; useIndex < endIndex; useIndex++) {
-      ResolvedUse<W> use;
-      int err;
-      if ((err = ResolveUse<E, StartDefIndex>(&use, useIndex, trace,
-                                              fullTrace)) < 0)
-        return err;
-      std::fprintf(f, "%" PRIu32 ",%" PRIu32 ",%s,%" PRIu64 ",%" PRIu64 "\n",
-                   traceIndex, use.traceIndex, prefix,
-                   static_cast<std::uint64_t>(use.range.startAddr),
-                   static_cast<std::uint64_t>(use.range.endAddr));
-    }
-    return 0;
-  }
-
   void AddDef(W startAddr, W endAddr) {
     std::uint32_t defIndex = static_cast<std::uint32_t>(defs_.size());
     defs_.emplace_back();
@@ -1694,6 +1887,8 @@ class UdBase {
   virtual int DumpDot(const char* dot) const = 0;
   virtual int DumpHtml(const char* html) const = 0;
   virtual int DumpCsv(const char* csv) const = 0;
+  virtual int Dump(const char* dot, const char* html,
+                   const char* csv) const = 0;
 };
 
 template <Endianness E, typename W>
@@ -1836,17 +2031,16 @@ class Ud : public UdBase {
 
   std::vector<std::uint32_t> GetCodesForPcRanges(
       const std::vector<Range<std::uint64_t>>& pcRanges) const override {
+    const std::vector<PcIndexEntry>& pcIndex = GetPcIndex();
     std::vector<std::uint32_t> codes;
-    for (std::uint32_t code = 0,
-                       size = static_cast<std::uint32_t>(code_.size());
-         code < size; code++)
-      for (const Range<std::uint64_t>& pcRange : pcRanges) {
-        std::uint64_t pc = code_[code].pc;
-        if (pc >= pcRange.startAddr && pc <= pcRange.endAddr) {
-          codes.push_back(code);
-          break;
-        }
-      }
+    for (const Range<std::uint64_t>& pcRange : pcRanges)
+      for (std::vector<PcIndexEntry>::const_iterator it =
+               std::lower_bound(pcIndex.begin(), pcIndex.end(),
+                                PcIndexEntry{pcRange.startAddr, 0});
+           it != pcIndex.end() && it->first <= pcRange.endAddr; ++it)
+        codes.push_back(it->second);
+    std::sort(codes.begin(), codes.end());
+    codes.erase(std::unique(codes.begin(), codes.end()), codes.end());
     return codes;
   }
 
@@ -1987,6 +2181,22 @@ class Ud : public UdBase {
     return 0;
   }
 
+  using PcIndexEntry = std::pair<std::uint64_t, std::uint32_t>;
+
+  // code_ sorted by pc, built on first lookup.
+  const std::vector<PcIndexEntry>& GetPcIndex() const {
+    if (pcIndex_.size() != code_.size()) {
+      pcIndex_.clear();
+      pcIndex_.reserve(code_.size());
+      for (std::uint32_t code = 0,
+                         size = static_cast<std::uint32_t>(code_.size());
+           code < size; code++)
+        pcIndex_.emplace_back(code_[code].pc, code);
+      std::sort(pcIndex_.begin(), pcIndex_.end());
+    }
+    return pcIndex_;
+  }
+
   int HandleInsnSeq(std::uint32_t insnSeq) {
     if (trace_.back().codeIndex == insnSeq) return 0;
     int ret;
@@ -1996,118 +2206,194 @@ class Ud : public UdBase {
   }
 
   int DumpDot(const char* dot) const override {
-    std::FILE* f = std::fopen(dot, "w");
-    if (f == nullptr) return -errno;
-    std::fprintf(f, "digraph ud {\n");
-    for (std::uint32_t traceIndex = 0; traceIndex < trace_.size();
-         traceIndex++) {
-      const InsnInTrace& trace = trace_[traceIndex];
-      const InsnInCode<W>& code = code_[trace.codeIndex];
-      std::fprintf(
-          f, "    %" PRIu32 " [label=\"[%" PRIu32 "] 0x%" PRIx64 ": %s\"]\n",
-          traceIndex, traceIndex, static_cast<std::uint64_t>(code.pc),
-          disasm_[trace.codeIndex].c_str());
-      int err;
-      if ((err = regState_
-                     .template DumpUsesDot<E, &InsnInTrace::regDefStartIndex>(
-                         f, traceIndex, trace.regUseStartIndex,
-                         trace.regUseStartIndex + trace.regUseCount, trace_,
-                         fullTrace_.get(), "r")) < 0)
-        return err;
-      if ((err = memState_
-                     .template DumpUsesDot<E, &InsnInTrace::memDefStartIndex>(
-                         f, traceIndex, trace.memUseStartIndex,
-                         trace.memUseStartIndex + trace.memUseCount, trace_,
-                         fullTrace_.get(), "m")) < 0)
-        return err;
-    }
-    std::fprintf(f, "}\n");
-    std::fclose(f);
-    return 0;
+    return Dump(dot, nullptr, nullptr);
   }
 
   int DumpHtml(const char* html) const override {
-    std::FILE* f = std::fopen(html, "w");
-    if (f == nullptr) return -errno;
-    std::fprintf(f,
-                 "<!DOCTYPE html>\n"
-                 "<html>\n"
-                 "<head>\n"
-                 "<title>ud</title>\n"
-                 "</head>\n"
-                 "<body>\n"
-                 "<table>\n"
-                 "    <tr>\n"
-                 "        <th>Seq</th>\n"
-                 "        <th>Address</th>\n"
-                 "        <th>Bytes</th>\n"
-                 "        <th>Instruction</th>\n"
-                 "        <th>Uses</th>\n"
-                 "        <th>Defs</th>\n"
-                 "    </tr>\n");
+    return Dump(nullptr, html, nullptr);
+  }
+
+  int DumpCsv(const char* csv) const override {
+    return Dump(nullptr, nullptr, csv);
+  }
+
+  // Writes all the requested formats during a single pass over the trace, so
+  // that the uses, which require seeking around the full trace in order to be
+  // resolved, are resolved only once.
+  int Dump(const char* dot, const char* html, const char* csv) const override {
+    int err;
+    PathWithPlaceholder csvPath;
+    if (csv != nullptr) {
+      if ((err = csvPath.Init(csv, "csv")) < 0) return err;
+      if ((err = DumpCodeCsv(csvPath.Get("code").c_str())) < 0) return err;
+      if ((err = DumpTraceCsv(csvPath.Get("trace").c_str())) < 0) return err;
+    }
+    FilePtr dotFile;
+    if (dot != nullptr) {
+      dotFile.reset(OpenOutput(dot));
+      if (!dotFile) return -errno;
+      std::fprintf(dotFile.get(), "digraph ud {\n");
+    }
+    FilePtr htmlFile;
+    if (html != nullptr) {
+      htmlFile.reset(OpenOutput(html));
+      if (!htmlFile) return -errno;
+      std::fprintf(htmlFile.get(),
+                   "<!DOCTYPE html>\n"
+                   "<html>\n"
+                   "<head>\n"
+                   "<title>ud</title>\n"
+                   "</head>\n"
+                   "<body>\n"
+                   "<table>\n"
+                   "    <tr>\n"
+                   "        <th>Seq</th>\n"
+                   "        <th>Address</th>\n"
+                   "        <th>Bytes</th>\n"
+                   "        <th>Instruction</th>\n"
+                   "        <th>Uses</th>\n"
+                   "        <th>Defs</th>\n"
+                   "    </tr>\n");
+    }
+    FilePtr usesCsvFile;
+    if (csv != nullptr) {
+      usesCsvFile.reset(OpenOutput(csvPath.Get("uses").c_str()));
+      if (!usesCsvFile) return -errno;
+    }
+    std::vector<ResolvedUse<W>> regUses;
+    std::vector<ResolvedUse<W>> memUses;
     for (std::uint32_t traceIndex = 0; traceIndex < trace_.size();
          traceIndex++) {
       const InsnInTrace& trace = trace_[traceIndex];
-      const InsnInCode<W>& code = code_[trace.codeIndex];
-      std::fprintf(f,
-                   "    <tr id=\"%" PRIu32
-                   "\">\n"
-                   "        <td>%" PRIu32
-                   "</td>\n"
-                   "        <td>0x%" PRIx64
-                   "</td>\n"
-                   "        <td>",
-                   traceIndex, traceIndex, static_cast<std::uint64_t>(code.pc));
-      HexDump(f, &text_[code.textIndex], code.textSize);
-      std::fprintf(f,
-                   "</td>\n"
-                   "        <td>");
-      HtmlDump(f, disasm_[trace.codeIndex].c_str());
-      std::fprintf(f,
-                   "</td>\n"
-                   "        <td>\n");
-      int err;
       if ((err = regState_
-                     .template DumpUsesHtml<E, &InsnInTrace::regDefStartIndex>(
-                         f, trace.regUseStartIndex,
+                     .template ResolveUses<E, &InsnInTrace::regDefStartIndex>(
+                         &regUses, trace.regUseStartIndex,
                          trace.regUseStartIndex + trace.regUseCount, trace_,
-                         fullTrace_.get(), "r")) < 0)
+                         fullTrace_.get())) < 0)
         return err;
       if ((err = memState_
-                     .template DumpUsesHtml<E, &InsnInTrace::memDefStartIndex>(
-                         f, trace.memUseStartIndex,
+                     .template ResolveUses<E, &InsnInTrace::memDefStartIndex>(
+                         &memUses, trace.memUseStartIndex,
                          trace.memUseStartIndex + trace.memUseCount, trace_,
-                         fullTrace_.get(), "m")) < 0)
+                         fullTrace_.get())) < 0)
         return err;
-      std::fprintf(f,
-                   "        </td>\n"
-                   "        <td>\n");
-      if ((err = regState_
-                     .template DumpDefsHtml<E, &InsnInTrace::regDefStartIndex>(
-                         f, trace.regDefStartIndex,
-                         trace.regDefStartIndex + trace.regDefCount, trace_,
-                         fullTrace_.get(), "r")) < 0)
-        return err;
-      if ((err = memState_
-                     .template DumpDefsHtml<E, &InsnInTrace::memDefStartIndex>(
-                         f, trace.memDefStartIndex,
-                         trace.memDefStartIndex + trace.memDefCount, trace_,
-                         fullTrace_.get(), "m")) < 0)
+      if (dotFile) DumpTraceDot(dotFile.get(), traceIndex, regUses, memUses);
+      if (htmlFile && (err = DumpTraceHtml(htmlFile.get(), traceIndex, regUses,
+                                           memUses)) < 0)
         return err;
-      std::fprintf(f,
-                   "        </td>\n"
-                   "    </tr>\n");
+      if (usesCsvFile) {
+        DumpUsesCsv(usesCsvFile.get(), traceIndex, regUses, "r");
+        DumpUsesCsv(usesCsvFile.get(), traceIndex, memUses, "m");
+      }
     }
+    if (dotFile) std::fprintf(dotFile.get(), "}\n");
+    if (htmlFile)
+      std::fprintf(htmlFile.get(),
+                   "</table>\n"
+                   "</body>\n"
+                   "</html>\n");
+    if ((err = CloseOutput(&dotFile)) < 0) return err;
+    if ((err = CloseOutput(&htmlFile)) < 0) return err;
+    if ((err = CloseOutput(&usesCsvFile)) < 0) return err;
+    return 0;
+  }
+
+  void DumpTraceDot(std::FILE* f, std::uint32_t traceIndex,
+                    const std::vector<ResolvedUse<W>>& regUses,
+                    const std::vector<ResolvedUse<W>>& memUses) const {
+    const InsnInTrace& trace = trace_[traceIndex];
+    const InsnInCode<W>& code = code_[trace.codeIndex];
+    std::fprintf(
+        f, "    %" PRIu32 " [label=\"[%" PRIu32 "] 0x%" PRIx64 ": %s\"]\n",
+        traceIndex, traceIndex, static_cast<std::uint64_t>(code.pc),
+        disasm_[trace.codeIndex].c_str());
+    DumpUsesDot(f, traceIndex, regUses, "r");
+    DumpUsesDot(f, traceIndex, memUses, "m");
+  }
+
+  static void DumpUsesDot(std::FILE* f, std::uint32_t traceIndex,
+                          const std::vector<ResolvedUse<W>>& uses,
+                          const char* prefix) {
+    for (const ResolvedUse<W>& use : uses)
+      std::fprintf(f,
+                   "    %" PRIu32 " -> %" PRIu32 " [label=\"%s0x%" PRIx64
+                   "-0x%" PRIx64 "\"]\n",
+                   traceIndex, use.traceIndex, prefix,
+                   static_cast<std::uint64_t>(use.range.startAddr),
+                   static_cast<std::uint64_t>(use.range.endAddr));
+  }
+
+  [[nodiscard]] int DumpTraceHtml(
+      std::FILE* f, std::uint32_t traceIndex,
+      const std::vector<ResolvedUse<W>>& regUses,
+      const std::vector<ResolvedUse<W>>& memUses) const {
+    const InsnInTrace& trace = trace_[traceIndex];
+    const InsnInCode<W>& code = code_[trace.codeIndex];
+    std::fprintf(f,
+                 "    <tr id=\"%" PRIu32
+                 "\">\n"
+                 "        <td>%" PRIu32
+                 "</td>\n"
+                 "        <td>0x%" PRIx64
+                 "</td>\n"
+                 "        <td>",
+                 traceIndex, traceIndex, static_cast<std::uint64_t>(code.pc));
+    HexDump(f, &text_[code.textIndex], code.textSize);
     std::fprintf(f,
-                 "</table>\n"
-                 "</body>\n"
-                 "</html>\n");
-    std::fclose(f);
+                 "</td>\n"
+                 "        <td>");
+    HtmlDump(f, disasm_[trace.codeIndex].c_str());
+    std::fprintf(f,
+                 "</td>\n"
+                 "        <td>\n");
+    DumpUsesHtml(f, regUses, "r");
+    DumpUsesHtml(f, memUses, "m");
+    std::fprintf(f,
+                 "        </td>\n"
+                 "        <td>\n");
+    int err;
+    if ((err =
+             regState_.template DumpDefsHtml<E, &InsnInTrace::regDefStartIndex>(
+                 f, trace.regDefStartIndex,
+                 trace.regDefStartIndex + trace.regDefCount, trace_,
+                 fullTrace_.get(), "r")) < 0)
+      return err;
+    if ((err =
+             memState_.template DumpDefsHtml<E, &InsnInTrace::memDefStartIndex>(
+                 f, trace.memDefStartIndex,
+                 trace.memDefStartIndex + trace.memDefCount, trace_,
+                 fullTrace_.get(), "m")) < 0)
+      return err;
+    std::fprintf(f,
+                 "        </td>\n"
+                 "    </tr>\n");
     return 0;
   }
 
+  static void DumpUsesHtml(std::FILE* f,
+                           const std::vector<ResolvedUse<W>>& uses,
+                           const char* prefix) {
+    for (const ResolvedUse<W>& use : uses)
+      std::fprintf(f,
+                   "            <a href=\"#%" PRIu32 "\">%s0x%" PRIx64
+                   "-0x%" PRIx64 "</a>\n",
+                   use.traceIndex, prefix,
+                   static_cast<std::uint64_t>(use.range.startAddr),
+                   static_cast<std::uint64_t>(use.range.endAddr));
+  }
+
+  static void DumpUsesCsv(std::FILE* f, std::uint32_t traceIndex,
+                          const std::vector<ResolvedUse<W>>& uses,
+                          const char* prefix) {
+    for (const ResolvedUse<W>& use : uses)
+      std::fprintf(f, "%" PRIu32 ",%" PRIu32 ",%s,%" PRIu64 ",%" PRIu64 "\n",
+                   traceIndex, use.traceIndex, prefix,
+                   static_cast<std::uint64_t>(use.range.startAddr),
+                   static_cast<std::uint64_t>(use.range.endAddr));
+  }
+
   int DumpCodeCsv(const char* path) const {
-    std::FILE* f = std::fopen(path, "w");
+    std::FILE* f = OpenOutput(path);
     if (f == nullptr) return -errno;
     for (std::uint32_t codeIndex = 0; codeIndex < code_.size(); codeIndex++) {
       const InsnInCode<W>& code = code_[codeIndex];
@@ -2116,51 +2402,17 @@ class Ud : public UdBase {
       HexDump(f, &text_[code.textIndex], code.textSize);
       std::fprintf(f, ",\"%s\"\n", disasm_[codeIndex].c_str());
     }
-    std::fclose(f);
+    if (std::fclose(f) == EOF) return -errno;
     return 0;
   }
 
   int DumpTraceCsv(const char* path) const {
-    std::FILE* f = std::fopen(path, "w");
+    std::FILE* f = OpenOutput(path);
     if (f == nullptr) return -errno;
     for (std::uint32_t traceIndex = 0; traceIndex < trace_.size(); traceIndex++)
       std::fprintf(f, "%" PRIu32 ",%" PRIu32 "\n", traceIndex,
                    trace_[traceIndex].codeIndex);
-    std::fclose(f);
-    return 0;
-  }
-
-  int DumpUsesCsv(const char* path) const {
-    std::FILE* f = std::fopen(path, "w");
-    if (f == nullptr) return -errno;
-    for (std::uint32_t traceIndex = 0; traceIndex < trace_.size();
-         traceIndex++) {
-      const InsnInTrace& trace = trace_[traceIndex];
-      int err;
-      if ((err = regState_
-                     .template DumpUsesCsv<E, &InsnInTrace::regDefStartIndex>(
-                         f, traceIndex, trace.regUseStartIndex,
-                         trace.regUseStartIndex + trace.regUseCount, trace_,
-                         fullTrace_.get(), "r")) < 0)
-        return err;
-      if ((err = memState_
-                     .template DumpUsesCsv<E, &InsnInTrace::memDefStartIndex>(
-                         f, traceIndex, trace.memUseStartIndex,
-                         trace.memUseStartIndex + trace.memUseCount, trace_,
-                         fullTrace_.get(), "m")) < 0)
-        return err;
-    }
-    std::fclose(f);
-    return 0;
-  }
-
-  int DumpCsv(const char* csv) const override {
-    PathWithPlaceholder csvPath;
-    int err;
-    if ((err = csvPath.Init(csv, "csv")) < 0) return err;
-    if ((err = DumpCodeCsv(csvPath.Get("code").c_str())) < 0) return err;
-    if ((err = DumpTraceCsv(csvPath.Get("trace").c_str())) < 0) return err;
-    if ((err = DumpUsesCsv(csvPath.Get("uses").c_str())) < 0) return err;
+    if (std::fclose(f) == EOF) return -errno;
     return 0;
   }
 
@@ -2186,6 +2438,7 @@ class Ud : public UdBase {
   UdState<W> regState_;
   UdState<W> memState_;
   PathWithPlaceholder binaryPath_;
+  mutable std::vector<PcIndexEntry> pcIndex_;
 };
 
 int ReadUdHeader(const char* rawPath, BinaryHeader* header) {
@@ -2223,7 +2476,7 @@ UdBase* UdBase::Analyze(const char* path, std::shared_ptr<TraceBase> trace,
   if (log == nullptr) {
     f = nullptr;
   } else {
-    f = fopen(log, "w");
+    f = OpenOutput(log);
     if (f == nullptr) return nullptr;
   }
   UdBase* ud = nullptr;
@@ -2357,7 +2610,10 @@ BOOST_PYTHON_MODULE(_memtrace) {
       .def("seek_start", &TraceBase::SeekStart)
       .def("seek_insn", &TraceBase::SeekInsn)
       .def("seek_end", &TraceBase::SeekEnd)
+      .def("get_entry_index", &TraceBase::GetEntryIndex)
+      .def("advise", &TraceBase::Advise)
       .def("gather_stats", &TraceBase::GatherStats)
+      .def("gather_stats_parallel", &TraceBase::GatherStatsParallel)
       .def("has_insn_index", &TraceBase::HasInsnIndex)
       .def("build_insn_index", &TraceBase::BuildInsnIndex)
       .def("load_insn_index", &TraceBase::LoadInsnIndex)
@@ -2391,7 +2647,8 @@ BOOST_PYTHON_MODULE(_memtrace) {
       .def("get_trace_for_mem_use", &UdBase::GetTraceForMemUse)
       .def("dump_dot", &UdBase::DumpDot)
       .def("dump_html", &UdBase::DumpHtml)
-      .def("dump_csv", &UdBase::DumpCsv);
+      .def("dump_csv", &UdBase::DumpCsv)
+      .def("dump", &UdBase::Dump);
   bp::class_<Disasm, boost::noncopyable>("Disasm", bp::no_init)
       .def("__init__", bp::make_constructor(CreateDisasm))
       .def("disasm_str", &Disasm::DisasmStr);
@@ -2403,6 +2660,9 @@ BOOST_PYTHON_MODULE(_memtrace) {
       .def_readonly("line", &LinePy::line);
   bp::enum_<DumpKind> dumpKind("DumpKind");
   RegisterEnumValues(&dumpKind, DumpKind::Raw, DumpKind::Source);
+  bp::enum_<Advice> advice("Advice");
+  RegisterEnumValues(&advice, Advice::Normal, Advice::Sequential,
+                     Advice::Random);
   bp::enum_<InsnFlags> insnFlags("InsnFlags");
   RegisterEnumValues(&insnFlags, InsnFlags::MT_INSN_INDIRECT_JUMP);
 }
@@ -27,6 +27,9 @@ skbuild.setup(
         "dataclasses; python_version < '3.7'",
         "sortedcontainers",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+    },
     package_data={
         "memtrace": [
             "memtrace.ipynb",
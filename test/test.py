@@ -14,7 +14,9 @@ import time
 from typing import List
 import unittest
 
+from memtrace.analysis import Analysis
 import memtrace.cli
+import memtrace.compression
 from memtrace.format import format_entry
 from memtrace.symbolizer import Symbolizer
 from memtrace.trace import Trace
@@ -224,6 +226,218 @@ class MachineTest(CommonTest):
         self.filter_file(actual_dump_txt)
         diff_files(expected_dump_txt, actual_dump_txt)
 
+    def _dump_range(self, dump_txt: str, range_args: List[str]) -> None:
+        actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
+        expected_dump_txt = os.path.join(self.basedir, dump_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Build a fresh index in order to exercise skipping parts of the
+            # trace.
+            index = os.path.join(tmpdir, "index-{}.bin")
+            with self.assertRaises(SystemExit) as system_exit:
+                memtrace.cli.main(
+                    [
+                        "report",
+                        f"--input={self.trace_path}",
+                        f"--index={index}",
+                        f"--output={actual_dump_txt}",
+                        *range_args,
+                    ]
+                )
+            self.assertEqual(0, system_exit.exception.code)
+        self.filter_file(actual_dump_txt)
+        diff_files(expected_dump_txt, actual_dump_txt)
+
+    def test_dump_head(self) -> None:
+        self._dump_range(f"{self.get_target()}-dump-head.txt", ["--head=5"])
+
+    def test_dump_tail(self) -> None:
+        self._dump_range(f"{self.get_target()}-dump-tail.txt", ["--tail=5"])
+
+    def test_dump_tail_all(self) -> None:
+        self._dump_range(f"{self.get_target()}-dump.txt", ["--tail=1000000"])
+
+    def test_dump_pipe(self) -> None:
+        dump_txt = f"{self.get_target()}-dump.txt"
+        actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
+        expected_dump_txt = os.path.join(self.basedir, dump_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fifo = os.path.join(tmpdir, "fifo")
+            os.mkfifo(fifo)
+            # The first run writes to a pipe on stdout, the second one to a
+            # named pipe, whose reader must not see a premature EOF.
+            for output_args in ([], [f"--output={fifo}"]):
+                with subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-m",
+                        "memtrace.cli",
+                        "report",
+                        f"--input={self.trace_path}",
+                        *output_args,
+                    ],
+                    stdout=subprocess.PIPE,
+                    env={
+                        **os.environ,
+                        "PYTHONPATH": os.path.dirname(self.pydir),
+                    },
+                ) as p:
+                    if len(output_args) == 0:
+                        output = p.stdout.read()
+                    else:
+                        with open(fifo, "rb") as fp:
+                            output = fp.read()
+                    self.assertEqual(0, p.wait(timeout=60))
+                with open(actual_dump_txt, "wb") as fp:
+                    fp.write(output)
+                self.filter_file(actual_dump_txt)
+                diff_files(expected_dump_txt, actual_dump_txt)
+
+    def _dump_tag(self, dump_txt: str, tag: str) -> None:
+        actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
+        expected_dump_txt = os.path.join(self.basedir, dump_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # A private copy of the trace has no default index, so the first
+            # run scans the whole trace, and the second one skips the parts
+            # that do not contain the tag using a fresh index.
+            input = os.path.join(tmpdir, os.path.basename(self.trace_path))
+            shutil.copyfile(self.trace_path, input)
+            index = os.path.join(tmpdir, "index-{}.bin")
+            for index_args in ([], [f"--index={index}"]):
+                with self.assertRaises(SystemExit) as system_exit:
+                    memtrace.cli.main(
+                        [
+                            "report",
+                            f"--input={input}",
+                            *index_args,
+                            f"--output={actual_dump_txt}",
+                            f"--tag={tag}",
+                        ]
+                    )
+                self.assertEqual(0, system_exit.exception.code)
+                self.filter_file(actual_dump_txt)
+                diff_files(expected_dump_txt, actual_dump_txt)
+
+    def test_dump_rare_tag(self) -> None:
+        self._dump_tag(f"{self.get_target()}-dump-mmap.txt", "MT_MMAP")
+
+    def test_dump_common_tag(self) -> None:
+        self._dump_tag(f"{self.get_target()}-dump-insn-exec.txt", "MT_INSN_EXEC")
+
+    def test_dump_head_and_tail(self) -> None:
+        with self.assertRaises(SystemExit) as system_exit:
+            memtrace.cli.main(
+                [
+                    "report",
+                    f"--input={self.trace_path}",
+                    f"--output={os.devnull}",
+                    "--head=5",
+                    "--tail=5",
+                ]
+            )
+        self.assertEqual(1, system_exit.exception.code)
+
+    def test_dump_compressed(self) -> None:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        dump_txt = f"{self.get_target()}-dump.txt"
+        actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
+        expected_dump_txt = os.path.join(self.basedir, dump_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input = os.path.join(tmpdir, "memtrace.out")
+            shutil.copyfile(self.trace_path, input)
+            memtrace.compression.compress(input)
+            self.assertTrue(memtrace.compression.is_zstd(input))
+            # The second run reuses the decompressed copy.
+            for _ in range(2):
+                with self.assertRaises(SystemExit):
+                    memtrace.cli.main(
+                        [
+                            "report",
+                            f"--input={input}",
+                            f"--output={actual_dump_txt}",
+                        ]
+                    )
+                self.filter_file(actual_dump_txt)
+                diff_files(expected_dump_txt, actual_dump_txt)
+            self.assertTrue(os.path.exists(input + ".decompressed"))
+
+    def test_dump_compressed_read_only(self) -> None:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        dump_txt = f"{self.get_target()}-dump.txt"
+        actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
+        expected_dump_txt = os.path.join(self.basedir, dump_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input = os.path.join(tmpdir, "memtrace.out")
+            shutil.copyfile(self.trace_path, input)
+            memtrace.compression.compress(input)
+            os.chmod(tmpdir, 0o555)
+            try:
+                if os.access(tmpdir, os.W_OK):
+                    self.skipTest("Permissions are not enforced")
+                with self.assertRaises(SystemExit):
+                    memtrace.cli.main(
+                        [
+                            "report",
+                            f"--input={input}",
+                            f"--output={actual_dump_txt}",
+                        ]
+                    )
+                self.filter_file(actual_dump_txt)
+                diff_files(expected_dump_txt, actual_dump_txt)
+                self.assertFalse(os.path.exists(input + ".decompressed"))
+            finally:
+                os.chmod(tmpdir, 0o755)
+
+    def test_record_compress(self) -> None:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        stats_txt = f"{self.get_target()}-stats.txt"
+        actual_stats_txt = os.path.join(self.workdir.name, stats_txt)
+        expected_stats_txt = os.path.join(self.basedir, stats_txt)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with tempfile.TemporaryFile() as fp:
+                fp.write(self.get_input())
+                fp.flush()
+                fp.seek(0)
+                subprocess.check_call(
+                    [
+                        sys.executable,
+                        "-m",
+                        "memtrace.cli",
+                        "record",
+                        "--compress",
+                        os.path.join(self.workdir.name, self.get_target()),
+                    ],
+                    stdin=fp,
+                    stdout=subprocess.DEVNULL,
+                    cwd=tmpdir,
+                    env={
+                        **os.environ,
+                        "PYTHONPATH": os.path.dirname(self.pydir),
+                    },
+                    preexec_fn=self.disable_aslr,
+                )
+            input = os.path.join(tmpdir, "memtrace.out")
+            self.assertTrue(memtrace.compression.is_zstd(input))
+            with self.assertRaises(SystemExit) as system_exit:
+                memtrace.cli.main(
+                    [
+                        "stats",
+                        f"--input={input}",
+                        f"--output={actual_stats_txt}",
+                    ]
+                )
+            self.assertEqual(0, system_exit.exception.code)
+        self.filter_file(actual_stats_txt)
+        diff_files(expected_stats_txt, actual_stats_txt)
+
     def test_dump_srcline(self) -> None:
         dump_txt = f"{self.get_target()}-dump-srcline.txt"
         actual_dump_txt = os.path.join(self.workdir.name, dump_txt)
@@ -364,7 +578,7 @@ class MachineTest(CommonTest):
         self.filter_file(actual)
         diff_files(expected, actual)
 
-    def test_stats(self) -> None:
+    def _stats(self, index_args: List[str]) -> None:
         stats_txt = f"{self.get_target()}-stats.txt"
         actual_stats_txt = os.path.join(self.workdir.name, stats_txt)
         expected_stats_txt = os.path.join(self.basedir, stats_txt)
@@ -374,6 +588,7 @@ class MachineTest(CommonTest):
                 [
                     "stats",
                     f"--input={input}",
+                    *index_args,
                     f"--output={actual_stats_txt}",
                 ]
             )
@@ -381,6 +596,32 @@ class MachineTest(CommonTest):
         self.filter_file(actual_stats_txt)
         diff_files(expected_stats_txt, actual_stats_txt)
 
+    def test_stats(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Use a nonexistent index in order to force the sequential scan.
+            index = os.path.join(tmpdir, "index-{}.bin")
+            self._stats([f"--index={index}"])
+
+    def test_stats_with_index(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index = os.path.join(tmpdir, "index-{}.bin")
+            with self.assertRaises(SystemExit) as system_exit:
+                input = os.path.join(self.workdir.name, "memtrace.out")
+                memtrace.cli.main(["index", f"--input={input}", f"--index={index}"])
+            self.assertEqual(0, system_exit.exception.code)
+            # Gathered in parallel, the result must be the same.
+            self._stats([f"--index={index}"])
+
+    def test_resolve_pc_before_ud(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with Analysis(
+                trace_path=self.trace_path,
+                index_path=os.path.join(tmpdir, "index-{}.bin"),
+            ) as analysis:
+                pc = memtrace.cli.resolve_pc(analysis, "_taintme")
+                # The use-def analysis must see the whole trace.
+                self.assertIsNotNone(analysis.get_last_trace_for_pc(pc))
+
     def test_traces_for_pc(self) -> None:
         traces_for_pc = f"{self.get_target()}-traces-for-pc.txt"
         actual = os.path.join(self.workdir.name, traces_for_pc)
@@ -509,5 +750,33 @@ class TestCat(CommonTest):
             )
 
 
+class TestCli(unittest.TestCase):
+    def assert_usage_error(self, args: List[str]) -> None:
+        with self.assertRaises(SystemExit) as system_exit:
+            memtrace.cli.main(args)
+        self.assertEqual(2, system_exit.exception.code)
+
+    def test_any_int(self) -> None:
+        any_int = memtrace.cli.AnyIntParamType()
+        self.assertEqual(0x10, any_int.convert("0x10", None, None))
+        self.assertEqual(0o10, any_int.convert("0o10", None, None))
+        self.assertEqual(10, any_int.convert("10", None, None))
+        self.assertEqual(1, any_int.convert(1, None, None))
+        self.assert_usage_error(["report", "--start=zz"])
+
+    def test_any_int_range(self) -> None:
+        any_int_range = memtrace.cli.AnyIntRangeParamType()
+        self.assertEqual((0x10, 0x20), any_int_range.convert("0x10-0x20", None, None))
+        self.assert_usage_error(["taint-backward", "--ignore-register=16"])
+        self.assert_usage_error(["taint-backward", "--ignore-register=16-zz"])
+
+    def test_tag(self) -> None:
+        tag = memtrace.cli.TagParamType()
+        self.assertEqual(Tag.MT_LOAD, tag.convert("MT_LOAD", None, None))
+        self.assert_usage_error(["report", "--tag=MT_BOGUS"])
+        self.assert_usage_error(["report", "--tag=MT_LAST"])
+        self.assert_usage_error(["report", "--tag=MT_HEADER32"])
+
+
 if __name__ == "__main__":
     unittest.main()